@@ -6,23 +6,34 @@
 
 
 from datetime import datetime
-from definitions import (ACTIVITY_CLUSTERS, 
+from definitions import (ACTIVITY_CLUSTERS, CHOOSE_ACTIVITY_LATENCY_BUDGET,
+                         DATABASE_CONNECTION_TIMEOUT, DATABASE_WRITE_TIMEOUT,
                          DATABASE_HOST, DATABASE_PASSWORD, 
                          DATABASE_PORT, DATABASE_USER, df_act,
-                         NUM_ACTIVITIES)
+                         GROUP_COMMIT_FLUSH_INTERVAL, GROUP_COMMIT_MAX_ROWS,
+                         GROUP_COMMIT_METRICS_LOG_INTERVAL,
+                         LOAD_SESSION_LATENCY_BUDGET, NUM_ACTIVITIES,
+                         PENDING_FALLBACK_CHOICE_TTL)
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from group_commit import DatabaseUnavailableError, GroupCommitWriter
+from idempotency import idempotent
 from rasa_sdk import Action, FormValidationAction, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import (ActionExecuted, FollowupAction, 
                              SessionStarted, SlotSet)
+from resilience import DB_BREAKER, run_db_calls
 from string import Template
+from telemetry import execute_many_query, execute_query
 from typing import Any, Dict, List, Optional, Text
 
+import asyncio
 import logging
 import mysql.connector
 import random
 import smtplib, ssl
+import threading
+import time
 
 
 class ActionSessionStart(Action):
@@ -146,7 +157,8 @@ def check_session_not_done_before(cur, prolific_id, session_num):
     if int(session_num) > 1:
 
         query = ("SELECT * FROM sessiondata WHERE prolific_id = %s and session_num = %s")
-        cur.execute(query, [prolific_id, session_num])
+        execute_query(cur, query, [prolific_id, session_num],
+                      prolific_id=prolific_id)
         done_before_result = cur.fetchone()
 
     # For session 1, sessiondata is only saved at the very end of the session.
@@ -156,7 +168,8 @@ def check_session_not_done_before(cur, prolific_id, session_num):
     # as we save the name after the mood has been entered.
     else:
         query = ("SELECT * FROM users WHERE prolific_id = %s")
-        cur.execute(query, [prolific_id])
+        execute_query(cur, query, [prolific_id],
+                      prolific_id=prolific_id)
         done_before_result = cur.fetchone()
 
     not_done_before = True
@@ -168,131 +181,213 @@ def check_session_not_done_before(cur, prolific_id, session_num):
     return not_done_before
 
 
+def load_session_first_from_db(prolific_id):
+    """Check in the db if the user has not done the first session before.
+
+    Database errors are raised, so that they are counted by the circuit
+    breaker.
+    """
+
+    conn = None
+    try:
+        conn = mysql.connector.connect(
+            user=DATABASE_USER,
+            password=DATABASE_PASSWORD,
+            host=DATABASE_HOST,
+            port=DATABASE_PORT,
+            database='db',
+            connection_timeout=DATABASE_CONNECTION_TIMEOUT
+        )
+        cur = conn.cursor(buffered=True)
+
+        session_loaded = check_session_not_done_before(cur, prolific_id, 1)
+
+    finally:
+        if conn is not None and conn.is_connected():
+            cur.close()
+            conn.close()
+
+    return session_loaded
+
+
 class ActionLoadSessionFirst(Action):
     
     def name(self) -> Text:
         return "action_load_session_first"
 
-    def run(self, dispatcher: CollectingDispatcher,
+    async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
         prolific_id = tracker.current_state()['sender_id']
-        session_loaded = False
-
-        try:
-            conn = mysql.connector.connect(
-                user=DATABASE_USER,
-                password=DATABASE_PASSWORD,
-                host=DATABASE_HOST,
-                port=DATABASE_PORT,
-                database='db'
-            )
-            cur = conn.cursor(buffered=True)
- 
-            session_loaded = check_session_not_done_before(cur, prolific_id, 1)
 
-        except mysql.connector.Error as error:
-            logging.info("Error in loading first session: " + str(error))
+        session_loaded = (await run_db_calls(
+            [(load_session_first_from_db, (prolific_id,))],
+            timeout=LOAD_SESSION_LATENCY_BUDGET))[0]
 
-        finally:
-            if conn.is_connected():
-                cur.close()
-                conn.close()
+        if session_loaded is None:
+            session_loaded = False
+            logging.info("Error in loading first session.")
 
         return [SlotSet("session_loaded", session_loaded)]
 
 
-class ActionLoadSessionNotFirst(Action):
+def load_session_not_first_from_db(prolific_id, session_num):
+    """Load the data from previous sessions that is needed for a session
+    other than the first one.
 
-    def name(self) -> Text:
-        return "action_load_session_not_first"
+    Database errors are raised, so that they are counted by the circuit
+    breaker.
+    """
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    session_loaded = True
+    mood_prev = ""
+    activity_verb_prev = ""
+    activity_history = []
+    user_name_exists = False
 
-        prolific_id = tracker.current_state()['sender_id']
-        session_num = tracker.get_slot("session_num")
+    conn = None
+    try:
+        conn = mysql.connector.connect(
+            user=DATABASE_USER,
+            password=DATABASE_PASSWORD,
+            host=DATABASE_HOST,
+            port=DATABASE_PORT,
+            database='db',
+            connection_timeout=DATABASE_CONNECTION_TIMEOUT
+        )
+        cur = conn.cursor(buffered=True)
 
-        session_loaded = True
-        mood_prev = ""
-        activity_verb_prev = ""
-        user_name_exists = False
+        # get user name from database
+        query = ("SELECT name FROM users WHERE prolific_id = %s")
+        execute_query(cur, query, [prolific_id],
+                      prolific_id=prolific_id)
+        user_name_result = cur.fetchone()
 
-        try:
-            conn = mysql.connector.connect(
-                user=DATABASE_USER,
-                password=DATABASE_PASSWORD,
-                host=DATABASE_HOST,
-                port=DATABASE_PORT,
-                database='db'
-            )
-            cur = conn.cursor(buffered=True)
-
-            # get user name from database
-            query = ("SELECT name FROM users WHERE prolific_id = %s")
-            cur.execute(query, [prolific_id])
-            user_name_result = cur.fetchone()
-
-            if user_name_result is None:
+        if user_name_result is None:
+            session_loaded = False
+
+        else:
+            user_name_result = user_name_result[0]
+            # Check if the user name is not our default value (which means that
+            # we could not extract the user name)
+            if user_name_result != "default":
+                user_name_exists = True
+
+            # check if user has done previous session before '
+            # (i.e., if session data is saved from previous session)
+            query = ("SELECT * FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
+            execute_query(cur, query, [prolific_id, str(int(session_num) - 1), "state_5"],
+                          prolific_id=prolific_id)
+            done_previous_result = cur.fetchone()
+
+            if done_previous_result is None:
                 session_loaded = False
 
             else:
-                user_name_result = user_name_result[0]
-                # Check if the user name is not our default value (which means that
-                # we could not extract the user name)
-                if user_name_result != "default":
-                    user_name_exists = True
-
-                # check if user has done previous session before '
-                # (i.e., if session data is saved from previous session)
-                query = ("SELECT * FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
-                cur.execute(query, [prolific_id, str(int(session_num) - 1), "state_5"])
-                done_previous_result = cur.fetchone()
-
-                if done_previous_result is None:
-                    session_loaded = False
- 
-                else:
-                    # check if user has not done this session before
-                    # checks if some data on this session is already saved in database
-                    # this basically means that it checks whether the user has already 
-                    # completed the session part until the dropout question before,
-                    # since that is when we first save something to the database
-                    session_loaded = check_session_not_done_before(cur, prolific_id, 
-                                                                   session_num)
-
-                    logging.info("session_loaded: " + str(session_loaded))
-
-                    if session_loaded:
-                        # Get mood from previous session
-                        query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
-                        cur.execute(query, [prolific_id, str(int(session_num) - 1), "mood"])
-                        mood_prev = cur.fetchone()[0]
-                        # Get activity index from previous session
-                        query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
-                        cur.execute(query, [prolific_id, str(int(session_num) - 1), "activity_new_index"])
-                        act_index = int(cur.fetchone()[0])
-                        activity_verb_prev = df_act.iloc[act_index]["Verb"]
-     
-
-        except mysql.connector.Error as error:
-            session_loaded = False
-            user_name_result = "default"
-            logging.info("Error in loading session not first: " + str(error))
+                # check if user has not done this session before
+                # checks if some data on this session is already saved in database
+                # this basically means that it checks whether the user has already 
+                # completed the session part until the dropout question before,
+                # since that is when we first save something to the database
+                session_loaded = check_session_not_done_before(cur, prolific_id, 
+                                                               session_num)
+
+                logging.info("session_loaded: " + str(session_loaded))
+
+                if session_loaded:
+                    # Get mood from previous session
+                    query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
+                    execute_query(cur, query, [prolific_id, str(int(session_num) - 1), "mood"],
+                                  prolific_id=prolific_id)
+                    mood_prev = cur.fetchone()[0]
+                    # Get activity index from previous session
+                    query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and session_num = %s and response_type = %s")
+                    execute_query(cur, query, [prolific_id, str(int(session_num) - 1), "activity_new_index"],
+                                  prolific_id=prolific_id)
+                    act_index = int(cur.fetchone()[0])
+                    activity_verb_prev = df_act.iloc[act_index]["Verb"]
+                    # Get all previous activity indices, so that a new
+                    # activity can be chosen even if the database is
+                    # not available later in the session
+                    query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and response_type = %s")
+                    execute_query(cur, query, [prolific_id, "activity_new_index"],
+                                  prolific_id=prolific_id)
+                    activity_history = [i[0] for i in cur.fetchall()]
+
+    finally:
+        if conn is not None and conn.is_connected():
+            cur.close()
+            conn.close()
+
+    return {"user_name": user_name_result,
+            "mood_prev": mood_prev,
+            "session_loaded": session_loaded,
+            "activity_verb_prev": activity_verb_prev,
+            "activity_history": activity_history,
+            "user_name_exists": user_name_exists}
+
+
+class ActionLoadSessionNotFirst(Action):
+
+    def name(self) -> Text:
+        return "action_load_session_not_first"
 
-        finally:
-            if conn.is_connected():
-                cur.close()
-                conn.close()
+    async def run(self, dispatcher: CollectingDispatcher,
+            tracker: Tracker,
+            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
+        prolific_id = tracker.current_state()['sender_id']
+        session_num = tracker.get_slot("session_num")
 
-        return [SlotSet("user_name_slot_not_first", user_name_result),
-                SlotSet("mood_prev_session", mood_prev),
-                SlotSet("session_loaded", session_loaded),
-                SlotSet("activity_prev_verb", activity_verb_prev),
-                SlotSet("user_name_exists", user_name_exists)]
+        loaded = (await run_db_calls(
+            [(load_session_not_first_from_db, (prolific_id, session_num))],
+            timeout=LOAD_SESSION_LATENCY_BUDGET))[0]
+
+        # The database failed, did not answer in time or the circuit is open
+        if loaded is None:
+            logging.info("Error in loading session not first.")
+            loaded = {"user_name": "default",
+                      "mood_prev": "",
+                      "session_loaded": False,
+                      "activity_verb_prev": "",
+                      "activity_history": [],
+                      "user_name_exists": False}
+
+        return [SlotSet("user_name_slot_not_first", loaded["user_name"]),
+                SlotSet("mood_prev_session", loaded["mood_prev"]),
+                SlotSet("session_loaded", loaded["session_loaded"]),
+                SlotSet("activity_prev_verb", loaded["activity_verb_prev"]),
+                SlotSet("activity_history", loaded["activity_history"]),
+                SlotSet("user_name_exists", loaded["user_name_exists"])]
+
+
+def connect_to_db():
+    "Open a connection to the database for the group commit writer."
+    return mysql.connector.connect(
+        user=DATABASE_USER,
+        password=DATABASE_PASSWORD,
+        host=DATABASE_HOST,
+        port=DATABASE_PORT,
+        database='db',
+        connection_timeout=DATABASE_CONNECTION_TIMEOUT
+    )
+
+
+# Commits the inserts of all conversations together
+GROUP_COMMIT_WRITER = GroupCommitWriter(GROUP_COMMIT_FLUSH_INTERVAL,
+                                        GROUP_COMMIT_MAX_ROWS,
+                                        GROUP_COMMIT_METRICS_LOG_INTERVAL,
+                                        connect=connect_to_db,
+                                        execute_many=execute_many_query,
+                                        breaker=DB_BREAKER)
+
+
+async def wait_for_commit(future):
+    """Wait until rows submitted to the group commit writer are committed,
+    for at most DATABASE_WRITE_TIMEOUT seconds."""
+    await asyncio.wait_for(asyncio.wrap_future(future),
+                           timeout=DATABASE_WRITE_TIMEOUT)
 
 
 class ActionSaveNameToDB(Action):
@@ -300,7 +395,8 @@ class ActionSaveNameToDB(Action):
     def name(self) -> Text:
         return "action_save_name_to_db"
 
-    def run(self, dispatcher: CollectingDispatcher,
+    @idempotent
+    async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
@@ -308,29 +404,17 @@ class ActionSaveNameToDB(Action):
         formatted_date = now.strftime('%Y-%m-%d %H:%M:%S')
 
         try:
-            conn = mysql.connector.connect(
-                user=DATABASE_USER,
-                password=DATABASE_PASSWORD,
-                host=DATABASE_HOST,
-                port=DATABASE_PORT,
-                database='db'
-            )
-            cur = conn.cursor(buffered=True)
             query = "INSERT INTO users(prolific_id, name, time) VALUES(%s, %s, %s)"
             queryMatch = [tracker.current_state()['sender_id'], 
                           tracker.get_slot("user_name_slot"),
                           formatted_date]
-            cur.execute(query, queryMatch)
-            conn.commit()
+            # Wait until the name has been committed
+            await wait_for_commit(GROUP_COMMIT_WRITER.submit(query, [queryMatch]))
 
-        except mysql.connector.Error as error:
+        except (mysql.connector.Error, DatabaseUnavailableError,
+                asyncio.TimeoutError) as error:
             logging.info("Error in saving name to db: " + str(error))
 
-        finally:
-            if conn.is_connected():
-                cur.close()
-                conn.close()
-
         return []
 
 
@@ -338,6 +422,7 @@ class ActionSaveActivityExperienc(Action):
     def name(self):
         return "action_save_activity_experience"
 
+    @idempotent
     async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
@@ -346,49 +431,47 @@ class ActionSaveActivityExperienc(Action):
         formatted_date = now.strftime('%Y-%m-%d %H:%M:%S')
 
         try:
-            conn = mysql.connector.connect(
-                user=DATABASE_USER,
-                password=DATABASE_PASSWORD,
-                host=DATABASE_HOST,
-                port=DATABASE_PORT,
-                database='db'
-            )
-            cur = conn.cursor(buffered=True)
-
             prolific_id = tracker.current_state()['sender_id']
             session_num = tracker.get_slot("session_num")
             slots_to_save = ["effort", "activity_experience_slot",
                              "activity_experience_mod_slot",
                              "dropout_response"]
-            for slot in slots_to_save:
 
-                save_sessiondata_entry(cur, conn, prolific_id, session_num,
-                                       slot, tracker.get_slot(slot),
-                                       formatted_date)
+            await wait_for_commit(
+                save_sessiondata_entries(prolific_id, session_num,
+                                         [(slot, tracker.get_slot(slot)) for slot in slots_to_save],
+                                         formatted_date))
 
-        except mysql.connector.Error as error:
+        except (mysql.connector.Error, DatabaseUnavailableError,
+                asyncio.TimeoutError) as error:
             logging.info("Error in saving activity experience to db: " + str(error))
 
-        finally:
-            if conn.is_connected():
-                cur.close()
-                conn.close()
-
         return []
 
 
-def save_sessiondata_entry(cur, conn, prolific_id, session_num, response_type,
-                           response_value, time):
+def save_sessiondata_entries(prolific_id, session_num, entries, time):
+    """
+       Queue entries to be saved in the sessiondata table.
+       The entries are committed together with those of other conversations.
+        Args:
+            prolific_id: the user ID
+            session_num: the session number
+            entries: list of (response_type, response_value) tuples
+            time: formatted date and time
+        Returns:
+            Future that is resolved once the entries are committed
+    """
     query = "INSERT INTO sessiondata(prolific_id, session_num, response_type, response_value, time) VALUES(%s, %s, %s, %s, %s)"
-    cur.execute(query, [prolific_id, session_num, response_type,
-                        response_value, time])
-    conn.commit()
+    rows = [[prolific_id, session_num, response_type, response_value, time]
+            for response_type, response_value in entries]
+    return GROUP_COMMIT_WRITER.submit(query, rows)
 
 
 class ActionSaveSession(Action):
     def name(self):
         return "action_save_session"
 
+    @idempotent
     async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
@@ -397,150 +480,243 @@ class ActionSaveSession(Action):
         formatted_date = now.strftime('%Y-%m-%d %H:%M:%S')
 
         try:
-            conn = mysql.connector.connect(
-                user=DATABASE_USER,
-                password=DATABASE_PASSWORD,
-                host=DATABASE_HOST,
-                port=DATABASE_PORT,
-                database='db'
-            )
-            cur = conn.cursor(buffered=True)
-
             prolific_id = tracker.current_state()['sender_id']
             session_num = tracker.get_slot("session_num")
 
             slots_to_save = ["mood", "state_1", "state_2", "state_3",
                              "state_4", "state_5", "state_6", "state_7",
                              "state_8", "state_9", "state_busy", "state_energy",
-                             "activity_new_index", "cluster_new_index"]
-            for slot in slots_to_save:
+                             "activity_new_index", "cluster_new_index",
+                             "activity_choice_degraded"]
 
-                save_sessiondata_entry(cur, conn, prolific_id, session_num,
-                                       slot, tracker.get_slot(slot),
-                                       formatted_date)
+            await wait_for_commit(
+                save_sessiondata_entries(prolific_id, session_num,
+                                         [(slot, tracker.get_slot(slot)) for slot in slots_to_save],
+                                         formatted_date))
 
-        except mysql.connector.Error as error:
+        except (mysql.connector.Error, DatabaseUnavailableError,
+                asyncio.TimeoutError) as error:
             logging.info("Error in save session: " + str(error))
 
-        finally:
-            if conn.is_connected():
-                cur.close()
-                conn.close()
-
         return []
 
 
 def get_previous_activity_indices_from_db(prolific_id):
-    "Get indices of the activities previously done by the user from the db."
+    """Get indices of the activities previously done by the user from the db.
+
+    Database errors are raised so that the caller can fall back to the
+    activity history carried in the slots.
+    """
 
+    conn = None
     try:
         conn = mysql.connector.connect(
             user=DATABASE_USER,
             password=DATABASE_PASSWORD,
             host=DATABASE_HOST,
             port=DATABASE_PORT,
-            database='db'
+            database='db',
+            connection_timeout=DATABASE_CONNECTION_TIMEOUT
         )
         cur = conn.cursor(buffered=True)
 
         # Get previous activity indices from db
         query = ("SELECT response_value FROM sessiondata WHERE prolific_id = %s and response_type = %s")
-        cur.execute(query, [prolific_id, "activity_new_index"])
+        execute_query(cur, query, [prolific_id, "activity_new_index"],
+                      prolific_id=prolific_id)
         result = cur.fetchall()
 
         # So far, we have sth. like [('49',), ('44',)]
         result = [i[0] for i in result]
 
-    except mysql.connector.Error as error:
-        logging.info("Error in getting previous activity indices from db: " + str(error))
-
     finally:
-        if conn.is_connected():
+        if conn is not None and conn.is_connected():
             cur.close()
             conn.close()
 
     return result
 
 
+# Last counts read from the database, used when the database is slow or down.
+# Choices made while the database could not be read are kept in the pending
+# lists as (prolific_id, session_num, index, time recorded) until they are
+# found in sessiondata, i.e., after action_save_session has saved them. Until
+# then they are added to both the cached and the freshly read counts.
+_last_known_counts = {"clusters": [0 for i in ACTIVITY_CLUSTERS],
+                      "activities": [0 for i in range(NUM_ACTIVITIES)],
+                      "pending_clusters": [],
+                      "pending_activities": []}
+_last_known_counts_lock = threading.Lock()
+
+
+def reconcile_pending_choices(pending, saved):
+    """
+       Remove pending fallback choices that have been saved in the meantime,
+       or that are too old to still be saved (e.g., because the user did not
+       finish the session).
+        Args:
+            pending: list of (prolific_id, session_num, index, time recorded)
+            saved: set of (prolific_id, session_num, index) saved in sessiondata
+        Returns:
+            The pending choices that are not saved yet
+    """
+    now = time.monotonic()
+    return [p for p in pending
+            if (p[0], p[1], str(p[2])) not in saved
+            and now - p[3] < PENDING_FALLBACK_CHOICE_TTL]
+
+
+def add_pending_choices(counts, pending, offset):
+    "Add the pending fallback choices to counts (offset: index of counts[0])."
+    counts = list(counts)
+    for p in pending:
+        counts[p[2] - offset] += 1
+    return counts
+
+
 def get_activity_cluster_counts_from_db():
-    "Compute how many times each activity cluster has already been chosen."
+    """Compute how many times each activity cluster has already been chosen,
+    including fallback choices that have not been saved yet."""
 
+    conn = None
     try:
         conn = mysql.connector.connect(
             user=DATABASE_USER,
             password=DATABASE_PASSWORD,
             host=DATABASE_HOST,
             port=DATABASE_PORT,
-            database='db'
+            database='db',
+            connection_timeout=DATABASE_CONNECTION_TIMEOUT
         )
         cur = conn.cursor(buffered=True)
 
         # Get cluster indices from database
-        query = ("SELECT response_value FROM sessiondata WHERE response_type = %s AND response_value IS NOT NULL")
-        cur.execute(query, ["cluster_new_index"])
+        query = ("SELECT prolific_id, session_num, response_value FROM sessiondata WHERE response_type = %s AND response_value IS NOT NULL")
+        execute_query(cur, query, ["cluster_new_index"])
         result = cur.fetchall()
 
-        cluster_indices = [int(i[0]) for i in result if not i[0] == '']
+        cluster_indices = [int(i[2]) for i in result if not i[2] == '']
         cluster_counts = [cluster_indices.count(i) for i in ACTIVITY_CLUSTERS]
 
-    except mysql.connector.Error as error:
-        logging.info("Error in getting act cluster counts from db: " + str(error))
-
     finally:
-        if conn.is_connected():
+        if conn is not None and conn.is_connected():
             cur.close()
             conn.close()
 
-    return cluster_counts
+    with _last_known_counts_lock:
+        _last_known_counts["clusters"] = cluster_counts
+        pending = reconcile_pending_choices(_last_known_counts["pending_clusters"],
+                                            set(result))
+        _last_known_counts["pending_clusters"] = pending
+
+    return add_pending_choices(cluster_counts, pending, ACTIVITY_CLUSTERS[0])
 
 
 def get_activity_counts_from_db():
-    "Compute how many times each activity has already been chosen overall."
+    """Compute how many times each activity has already been chosen overall,
+    including fallback choices that have not been saved yet."""
 
+    conn = None
     try:
         conn = mysql.connector.connect(
             user=DATABASE_USER,
             password=DATABASE_PASSWORD,
             host=DATABASE_HOST,
             port=DATABASE_PORT,
-            database='db'
+            database='db',
+            connection_timeout=DATABASE_CONNECTION_TIMEOUT
         )
         cur = conn.cursor(buffered=True)
 
         # Get activity indices from database
-        query = ("SELECT response_value FROM sessiondata WHERE response_type = %s AND response_value IS NOT NULL")
-        cur.execute(query, ["activity_new_index"])
+        query = ("SELECT prolific_id, session_num, response_value FROM sessiondata WHERE response_type = %s AND response_value IS NOT NULL")
+        execute_query(cur, query, ["activity_new_index"])
         result = cur.fetchall()
 
-        activity_indices = [int(i[0]) for i in result if not i[0] == '']
+        activity_indices = [int(i[2]) for i in result if not i[2] == '']
         activity_counts = [activity_indices.count(i) for i in range(0, NUM_ACTIVITIES)]
 
-    except mysql.connector.Error as error:
-        logging.info("Error in getting activity counts from db: " + str(error))
-
     finally:
-        if conn.is_connected():
+        if conn is not None and conn.is_connected():
             cur.close()
             conn.close()
 
-    return activity_counts
+    with _last_known_counts_lock:
+        _last_known_counts["activities"] = activity_counts
+        pending = reconcile_pending_choices(_last_known_counts["pending_activities"],
+                                            set(result))
+        _last_known_counts["pending_activities"] = pending
+
+    return add_pending_choices(activity_counts, pending, 0)
+
+
+def get_cached_activity_counts():
+    """
+       Get the last known cluster and activity counts, including the
+       fallback choices that have not been saved yet.
+        Returns:
+            Tuple of cluster counts and activity counts
+    """
+    with _last_known_counts_lock:
+        cluster_counts = add_pending_choices(_last_known_counts["clusters"],
+                                             _last_known_counts["pending_clusters"],
+                                             ACTIVITY_CLUSTERS[0])
+        activity_counts = add_pending_choices(_last_known_counts["activities"],
+                                              _last_known_counts["pending_activities"],
+                                              0)
+
+    return cluster_counts, activity_counts
+
+
+def record_fallback_choice(prolific_id, session_num, cluster_index, act_index):
+    "Remember an activity chosen while the database could not be read."
+
+    now = time.monotonic()
+    with _last_known_counts_lock:
+        _last_known_counts["pending_clusters"].append((prolific_id, session_num,
+                                                       cluster_index, now))
+        _last_known_counts["pending_activities"].append((prolific_id, session_num,
+                                                         act_index, now))
 
 
 class ActionChooseActivity(Action):
     def name(self):
         return "action_choose_activity"
 
+    @idempotent
     async def run(self, dispatcher, tracker, domain):
 
         prolific_id = tracker.current_state()['sender_id']
 
+        # Read the activity history and the counts concurrently. Anything that
+        # is not available within the latency budget (e.g., because the
+        # database is slow or down) is replaced by cached/slot-carried data.
+        curr_act_ind_list, cluster_counts, activity_counts = await run_db_calls(
+            [(get_previous_activity_indices_from_db, (prolific_id,)),
+             (get_activity_cluster_counts_from_db, ()),
+             (get_activity_counts_from_db, ())],
+            timeout=CHOOSE_ACTIVITY_LATENCY_BUDGET)
+
+        degraded = (curr_act_ind_list is None or cluster_counts is None
+                    or activity_counts is None)
+
         # get indices of previously assigned activities
         # this returns a list of strings
-        curr_act_ind_list = get_previous_activity_indices_from_db(prolific_id)
+        if curr_act_ind_list is None:
+            curr_act_ind_list = tracker.get_slot("activity_history")
+            logging.info("Using slot-carried activity history for " + prolific_id)
 
         if curr_act_ind_list is None:
             curr_act_ind_list = []
 
+        if cluster_counts is None or activity_counts is None:
+            cached_cluster_counts, cached_activity_counts = get_cached_activity_counts()
+            if cluster_counts is None:
+                cluster_counts = cached_cluster_counts
+            if activity_counts is None:
+                activity_counts = cached_activity_counts
+            logging.info("Using cached activity counts for " + prolific_id)
+
         # check excluded activities for previously assigned activities
         excluded = []
         for i in curr_act_ind_list:
@@ -564,9 +740,6 @@ class ActionChooseActivity(Action):
         # Check which clusters the remaining activities belong to -> possible clusters
         possible_clusters = list(set([df_act.iloc[i]["Cluster"] for i in remaining_indices]))
 
-        # Compute how often each cluster has already been chosen in the past
-        cluster_counts = get_activity_cluster_counts_from_db()
-
         # chose random new activity cluster
         # probability to be chosen is higher if cluster has been chosen less often so far
         # weights are relative
@@ -576,9 +749,6 @@ class ActionChooseActivity(Action):
                                            weights=[1/cluster_counts[i-1] if cluster_counts[i-1] > 0 else 1 for i in possible_clusters],
                                            k = 1)[0]
 
-        # Compute how often each activity has already been chosen in the past
-        activity_counts = get_activity_counts_from_db()
-
         # choose random new activity inside cluster
         # probability to be chosen is higher if activity has been chosen less often so far
         # Activity indices start at 0
@@ -588,75 +758,98 @@ class ActionChooseActivity(Action):
                                        weights = [1/activity_counts[i] if activity_counts[i] > 0 else 1 for i in activities_in_cluster],
                                        k = 1)[0]
 
+        if degraded:
+            record_fallback_choice(prolific_id, tracker.get_slot("session_num"),
+                                   int(new_cluster_index), int(new_act_index))
+
         return [SlotSet("activity_formulation_new_session", df_act.loc[new_act_index, 'Formulation Session']), 
                 SlotSet("activity_formulation_new_email", df_act.loc[new_act_index, 'Formulation Email']),
                 SlotSet("activity_new_index", str(new_act_index)),
                 SlotSet("activity_new_verb", df_act.loc[new_act_index, "Verb"]),
-                SlotSet("cluster_new_index", str(new_cluster_index))]
+                SlotSet("cluster_new_index", str(new_cluster_index)),
+                SlotSet("activity_choice_degraded", degraded)]
 
 
 # Send reminder email with activity
-class ActionSendEmail(Action):
-    def name(self):
-        return "action_send_email"
+def send_reminder_email(prolific_id: Text, session_num: Text,
+                        activity_formulation_email: Text) -> None:
+    """
+       Send the email that reminds the user of the chosen activity.
+       This blocks, so the action runs it in a thread.
+        Args:
+            prolific_id: ID of the user
+            session_num: number of the current session, as string
+            activity_formulation_email: formulation of the activity
+    """
+    ssl_port = 465
+    with open('x.txt', 'r') as f:
+        x = f.read()
+        x = x.rstrip()
+    smtp = "smtp.web.de"
+    with open('email.txt', 'r') as f:
+        email = f.read()
+        email = email.rstrip()
+    user_email = prolific_id + "@email.prolific.co"
 
-    async def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    context = ssl.create_default_context()
 
-        # get user ID
-        prolific_id = tracker.current_state()['sender_id']
+    # set up the SMTP server
+    with smtplib.SMTP_SSL(smtp, ssl_port, context = context) as server:
+        server.login(email, x)
 
-        activity_formulation_email = tracker.get_slot('activity_formulation_new_email')
-        session_num = tracker.get_slot('session_num')  # this is a string
+        msg = MIMEMultipart() # create a message
 
-        ssl_port = 465
-        with open('x.txt', 'r') as f:
-            x = f.read()
-            x = x.rstrip()
-        smtp = "smtp.web.de"
-        with open('email.txt', 'r') as f:
-            email = f.read()
-            email = email.rstrip()
-        user_email = prolific_id + "@email.prolific.co"
+        # Have a different message template for the last session
+        # And also have no next session then
+        template_file_name = "reminder_template_notlast.txt"
+        if session_num == "5":
+            template_file_name = "reminder_template_last.txt"
+            activity_formulation_email = activity_formulation_email.replace(" before the next session,", "")
+            activity_formulation_email = activity_formulation_email.replace(" before the next session", "")
+            activity_formulation_email = activity_formulation_email.replace("Before the next session, I", "I")
 
-        context = ssl.create_default_context()
 
-        # set up the SMTP server
-        with smtplib.SMTP_SSL(smtp, ssl_port, context = context) as server:
-            server.login(email, x)
+        with open(template_file_name, 'r', encoding='utf-8') as template_file:
+            message_template = Template(template_file.read())
 
-            msg = MIMEMultipart() # create a message
+        # add in the actual info to the message template
+        message_text = message_template.substitute(PERSON_NAME ="Study Participant",
+                                                   ACTIVITY= activity_formulation_email)
 
-            # Have a different message template for the last session
-            # And also have no next session then
-            template_file_name = "reminder_template_notlast.txt"
-            if session_num == "5":
-                template_file_name = "reminder_template_last.txt"
-                activity_formulation_email = activity_formulation_email.replace(" before the next session,", "")
-                activity_formulation_email = activity_formulation_email.replace(" before the next session", "")
-                activity_formulation_email = activity_formulation_email.replace("Before the next session, I", "I")
+        # set up the parameters of the message
+        msg['From'] = email
+        msg['To']=  user_email
+        msg['Subject'] = "Activity Reminder - Peparing for Quitting Smoking"
 
+        # add in the message body
+        msg.attach(MIMEText(message_text, 'plain'))
 
-            with open(template_file_name, 'r', encoding='utf-8') as template_file:
-                message_template = Template(template_file.read())
+        # send the message via the server set up earlier.
+        server.send_message(msg)
 
-            # add in the actual info to the message template
-            message_text = message_template.substitute(PERSON_NAME ="Study Participant",
-                                                       ACTIVITY= activity_formulation_email)
+        del msg
+
+
+class ActionSendEmail(Action):
+    def name(self):
+        return "action_send_email"
 
-            # set up the parameters of the message
-            msg['From'] = email
-            msg['To']=  user_email
-            msg['Subject'] = "Activity Reminder - Peparing for Quitting Smoking"
+    @idempotent
+    async def run(self, dispatcher: CollectingDispatcher,
+            tracker: Tracker,
+            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
-            # add in the message body
-            msg.attach(MIMEText(message_text, 'plain'))
+        # get user ID
+        prolific_id = tracker.current_state()['sender_id']
 
-            # send the message via the server set up earlier.
-            server.send_message(msg)
+        activity_formulation_email = tracker.get_slot('activity_formulation_new_email')
+        session_num = tracker.get_slot('session_num')  # this is a string
 
-            del msg
+        # smtplib blocks, so send the email in a thread, so that other
+        # conversations (and retries of this call) are not held up meanwhile
+        await asyncio.get_running_loop().run_in_executor(
+            None, send_reminder_email, prolific_id, session_num,
+            activity_formulation_email)
 
         return []
 
@@ -0,0 +1,100 @@
+"""
+Report the statements that take the most time in total, based on the query
+telemetry written by the action server.
+
+Usage: python analyze_query_telemetry.py [telemetry file] [--top N]
+Rotated files (e.g., query_telemetry.jsonl.1) are included automatically.
+"""
+
+import argparse
+import glob
+import json
+
+
+# Same as QUERY_TELEMETRY_FILE in definitions.py; not imported from there so
+# that the analysis can run without the action server dependencies.
+QUERY_TELEMETRY_FILE = "query_log/query_telemetry.jsonl"
+
+
+def load_records(path):
+    "Load the telemetry records from the file and its rotated versions."
+    records = []
+    for file_name in sorted(glob.glob(glob.escape(path) + "*")):
+        with open(file_name, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # e.g., a line cut off while the file was being written
+                    continue
+    return records
+
+
+def summarize(records):
+    """
+       Aggregate the records per statement fingerprint.
+       Sampled records are weighted by the inverse of their sample rate to
+       estimate the totals over all executed statements.
+        Args:
+            records: list of telemetry records
+        Returns:
+            List of dicts with one entry per fingerprint, sorted by
+            estimated total time (descending)
+    """
+    stats = {}
+    for record in records:
+        weight = 1 / record["sample_rate"] if record["sample_rate"] > 0 else 1
+        entry = stats.setdefault(record["fingerprint"],
+                                 {"fingerprint": record["fingerprint"],
+                                  "samples": 0,
+                                  "est_calls": 0.0,
+                                  "est_total_ms": 0.0,
+                                  "est_rows": 0.0,
+                                  "max_ms": 0.0,
+                                  "participants": set()})
+        entry["samples"] += 1
+        entry["est_calls"] += weight
+        entry["est_total_ms"] += weight * record["duration_ms"]
+        entry["est_rows"] += weight * max(record["rows"], 0)
+        entry["max_ms"] = max(entry["max_ms"], record["duration_ms"])
+        if record["participant"] is not None:
+            entry["participants"].add(record["participant"])
+
+    summary = []
+    for entry in stats.values():
+        entry["mean_ms"] = entry["est_total_ms"] / entry["est_calls"]
+        entry["participants"] = len(entry["participants"])
+        summary.append(entry)
+
+    return sorted(summary, key=lambda e: e["est_total_ms"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Top statements by total time.")
+    parser.add_argument("path", nargs="?", default=QUERY_TELEMETRY_FILE,
+                        help="telemetry file written by the action server")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of statements to report")
+    args = parser.parse_args()
+
+    summary = summarize(load_records(args.path))
+
+    if not summary:
+        print("No telemetry records found in " + args.path)
+        return
+
+    print("%12s %10s %9s %9s %10s %8s  %s" % ("total_ms", "calls", "mean_ms",
+                                              "max_ms", "rows", "samples",
+                                              "statement"))
+    for entry in summary[:args.top]:
+        print("%12.1f %10.0f %9.2f %9.2f %10.0f %8d  %s" % (
+            entry["est_total_ms"], entry["est_calls"], entry["mean_ms"],
+            entry["max_ms"], entry["est_rows"], entry["samples"],
+            entry["fingerprint"]))
+
+
+if __name__ == "__main__":
+    main()
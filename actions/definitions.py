@@ -2,13 +2,70 @@
 Store definitions used in rasa actions (e.g., related to database).
 """
 
+import logging
+import os
 import pandas as pd
+import secrets
 
 DATABASE_HOST = "mysql"
 DATABASE_PASSWORD = "treelisbonmaijanuar445599!!!!!22333"
 DATABASE_PORT = 3306
 DATABASE_USER = "root"
 
+# Seconds to wait when connecting to the database
+DATABASE_CONNECTION_TIMEOUT = 2
+# Seconds that saving an action's data may wait for the group commit
+DATABASE_WRITE_TIMEOUT = 10
+# Consecutive failed database calls after which we stop calling the database
+DATABASE_CIRCUIT_FAILURE_THRESHOLD = 3
+# Seconds before we try the database again after the circuit has opened
+DATABASE_CIRCUIT_RESET_TIMEOUT = 30
+# Number of threads for database calls from async actions
+DATABASE_MAX_WORKERS = 8
+
+# Query telemetry (replaces the MySQL general query log)
+# Fraction of statements that are recorded
+QUERY_TELEMETRY_SAMPLE_RATE = 0.1
+# Statements taking at least this many seconds are always recorded (None: off)
+QUERY_TELEMETRY_SLOW_THRESHOLD = 0.5
+QUERY_TELEMETRY_FILE = "query_log/query_telemetry.jsonl"
+# Size at which the file is rotated and number of rotated files to keep
+QUERY_TELEMETRY_MAX_BYTES = 10 * 1024 * 1024
+QUERY_TELEMETRY_BACKUP_COUNT = 5
+# Secret key for hashing participant IDs in the telemetry. Put a random key in
+# telemetry_key.txt (e.g., from "openssl rand -hex 32") so that the hashes stay
+# the same across restarts. Without it, a new key is used on every start.
+if os.path.exists("telemetry_key.txt"):
+    with open("telemetry_key.txt", 'r') as f:
+        QUERY_TELEMETRY_HMAC_KEY = f.read().rstrip().encode("utf-8")
+else:
+    logging.warning("No telemetry_key.txt, using a random key for hashing participant IDs.")
+    QUERY_TELEMETRY_HMAC_KEY = secrets.token_bytes(32)
+
+# Results of completed action calls are kept this many seconds, so that
+# retries by rasa are answered without running the action again
+IDEMPOTENCY_CACHE_TTL = 600
+# Maximum number of cached action results
+IDEMPOTENCY_CACHE_SIZE = 2000
+
+# Inserts from concurrent conversations are committed together after waiting
+# at most this many seconds for further rows ...
+GROUP_COMMIT_FLUSH_INTERVAL = 0.05
+# ... or as soon as this many rows are waiting
+GROUP_COMMIT_MAX_ROWS = 500
+# Log batch size and commit latency statistics every this many commits
+GROUP_COMMIT_METRICS_LOG_INTERVAL = 100
+
+# Seconds that choosing a new activity may spend waiting for the database
+# before falling back to cached counts
+CHOOSE_ACTIVITY_LATENCY_BUDGET = 3
+# Seconds after which an activity chosen without the database is no longer
+# counted if it has not been saved (e.g., because the session was not finished)
+PENDING_FALLBACK_CHOICE_TTL = 2 * 60 * 60
+# Seconds that loading the data at the start of a session may spend waiting for
+# the database
+LOAD_SESSION_LATENCY_BUDGET = 5
+
 
 # List of preparatory activities
 df_act = pd.read_excel("Activities.xlsx", 
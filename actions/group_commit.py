@@ -0,0 +1,242 @@
+"""
+Write-behind group commit of inserts into the database.
+
+Inserts from many concurrent conversations are collected by a single writer
+thread and committed together in one transaction, either after a flush
+interval or once enough rows are waiting. Each caller gets a future that is
+resolved only after its rows have been committed.
+
+The writer is created in actions.py with the database connection and query
+execution passed in, so that this module does not depend on the database
+driver or the settings in definitions.py.
+"""
+
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text
+
+import logging
+import threading
+import time
+
+
+class DatabaseUnavailableError(Exception):
+    "Raised for submissions that are not written because the circuit is open."
+
+
+class _Submission:
+    def __init__(self, query: Text, rows: List[Sequence[Any]]):
+        self.query = query
+        self.rows = rows
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """Coalesces inserts from many callers into periodic transactions.
+
+    If a group transaction fails, each submission of the group is retried
+    in its own transaction, so that one bad submission does not fail the
+    others. If the database cannot be reached, the whole group fails at once
+    instead. With a circuit breaker, no commits are attempted while the
+    circuit is open.
+    """
+
+    def __init__(self, flush_interval: float, max_rows: int,
+                 metrics_log_interval: int, connect: Callable[[], Any],
+                 execute_many: Callable[[Any, Text, List[Sequence[Any]]], None],
+                 breaker: Optional[Any] = None):
+        """
+           Args:
+               flush_interval: seconds to wait for further rows before a commit
+               max_rows: number of waiting rows that triggers a commit right away
+               metrics_log_interval: log the metrics every this many commits
+               connect: function that opens a database connection
+               execute_many: function(cursor, query, rows) that executes
+                   query for all rows
+               breaker: optional circuit breaker (see resilience.py) that
+                   records the outcome of each commit
+        """
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.metrics_log_interval = metrics_log_interval
+        self._connect = connect
+        self._execute_many = execute_many
+        self._breaker = breaker
+        self._pending = []
+        self._pending_rows = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._conn = None
+        self._metrics = {"batches": 0, "rows": 0, "max_batch_rows": 0,
+                         "commit_seconds": 0.0, "max_commit_seconds": 0.0,
+                         "failed_batches": 0}
+
+    def submit(self, query: Text, rows: List[Sequence[Any]]) -> Future:
+        """
+           Queue rows to be inserted with the given statement.
+            Args:
+                query: INSERT statement with placeholders for one row
+                rows: values for each row
+            Returns:
+                Future that is resolved once the rows are committed, or that
+                raises the database error if they could not be committed
+        """
+        submission = _Submission(query, rows)
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="group_commit",
+                                                daemon=True)
+                self._thread.start()
+            # Wake up the idle writer for the first submission, and again
+            # once enough rows are waiting to commit before the flush interval
+            if not self._pending or self._pending_rows + len(rows) >= self.max_rows:
+                self._condition.notify()
+            self._pending.append(submission)
+            self._pending_rows += len(rows)
+        return submission.future
+
+    def metrics(self) -> Dict[Text, Any]:
+        "Get batch size and commit latency statistics."
+        with self._condition:
+            metrics = dict(self._metrics)
+        if metrics["batches"] > 0:
+            metrics["mean_batch_rows"] = metrics["rows"] / metrics["batches"]
+            metrics["mean_commit_seconds"] = metrics["commit_seconds"] / metrics["batches"]
+        return metrics
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Give other conversations the chance to add their rows
+                if self._pending_rows < self.max_rows:
+                    self._condition.wait(self.flush_interval)
+                batch = self._pending
+                self._pending = []
+                self._pending_rows = 0
+
+            # Skip submissions whose caller was cancelled while waiting. The
+            # others can no longer be cancelled, so resolving them is safe.
+            batch = [submission for submission in batch
+                     if submission.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            # An unexpected error must not stop the writer, since all later
+            # saves would then wait forever
+            try:
+                self._flush(batch)
+            except Exception as error:
+                logging.exception("Unexpected error in group commit writer")
+                for submission in batch:
+                    if not submission.future.done():
+                        submission.future.set_exception(error)
+
+    def _flush(self, batch: List[_Submission]) -> None:
+        if self._breaker is not None and not self._breaker.allow_request():
+            self._fail(batch, DatabaseUnavailableError("Database circuit is open."))
+            return
+
+        start = time.perf_counter()
+        try:
+            self._ensure_connection()
+        except Exception as error:
+            # Retrying each submission would only block the writer for
+            # another connection timeout each
+            logging.info("Error in connecting for group commit: " + str(error))
+            self._record_metrics(batch, time.perf_counter() - start, failed=True)
+            self._record_breaker(success=False)
+            self._fail(batch, error)
+            return
+
+        try:
+            self._commit(batch)
+        except Exception as error:
+            logging.info("Error in group commit of " + str(len(batch))
+                         + " submission(s), retrying separately: " + str(error))
+            self._record_metrics(batch, time.perf_counter() - start, failed=True)
+            self._retry_separately(batch)
+            return
+
+        self._record_metrics(batch, time.perf_counter() - start, failed=False)
+        self._record_breaker(success=True)
+        for submission in batch:
+            submission.future.set_result(None)
+
+    def _retry_separately(self, batch: List[_Submission]) -> None:
+        "Commit each submission on its own, so that one bad one fails alone."
+        for i, submission in enumerate(batch):
+            try:
+                self._ensure_connection()
+            except Exception as error:
+                # The database cannot be reached anymore, fail the rest at once
+                self._record_breaker(success=False)
+                self._fail(batch[i:], error)
+                return
+
+            try:
+                self._commit([submission])
+            except Exception as error:
+                submission.future.set_exception(error)
+            else:
+                submission.future.set_result(None)
+
+        self._record_breaker(success=True)
+
+    def _ensure_connection(self) -> None:
+        if self._conn is None or not self._conn.is_connected():
+            self._conn = None
+            self._conn = self._connect()
+
+    def _record_breaker(self, success: bool) -> None:
+        if self._breaker is None:
+            return
+        if success:
+            self._breaker.record_success()
+        else:
+            self._breaker.record_failure()
+
+    @staticmethod
+    def _fail(batch: List[_Submission], error: Exception) -> None:
+        for submission in batch:
+            submission.future.set_exception(error)
+
+    def _commit(self, batch: List[_Submission]) -> None:
+        "Insert the rows of all submissions in a single transaction."
+        # Group the rows per statement, so that each statement is sent as
+        # a single multi-row insert
+        rows_per_query = {}
+        for submission in batch:
+            rows_per_query.setdefault(submission.query, []).extend(submission.rows)
+
+        cur = self._conn.cursor()
+        try:
+            for query, rows in rows_per_query.items():
+                self._execute_many(cur, query, rows)
+            self._conn.commit()
+        except Exception:
+            try:
+                self._conn.rollback()
+            except Exception:
+                self._conn = None
+            raise
+        finally:
+            if self._conn is not None:
+                cur.close()
+
+    def _record_metrics(self, batch: List[_Submission], duration: float,
+                        failed: bool) -> None:
+        num_rows = sum(len(submission.rows) for submission in batch)
+        with self._condition:
+            self._metrics["batches"] += 1
+            self._metrics["rows"] += num_rows
+            self._metrics["max_batch_rows"] = max(self._metrics["max_batch_rows"], num_rows)
+            self._metrics["commit_seconds"] += duration
+            self._metrics["max_commit_seconds"] = max(self._metrics["max_commit_seconds"], duration)
+            if failed:
+                self._metrics["failed_batches"] += 1
+            log_metrics = self._metrics["batches"] % self.metrics_log_interval == 0
+
+        if log_metrics:
+            logging.info("Group commit metrics: " + str(self.metrics()))
@@ -0,0 +1,136 @@
+"""
+De-duplication of repeated action calls.
+
+Rasa retries an action call if the action server is slow to answer. The retry
+has the same sender ID, action name, and latest tracker event as the original
+call, so we use these as key: completed results are answered from a cache, and
+a retry that arrives while the original call is still running waits for it.
+Actions run in their own task, so that they finish and are cached even if the
+request that started them is cancelled.
+"""
+
+from collections import OrderedDict
+from definitions import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL
+from rasa_sdk.executor import CollectingDispatcher
+from typing import Dict, List, Optional, Text, Tuple
+
+import asyncio
+import copy
+import functools
+import logging
+import threading
+import time
+
+
+class ActionResultCache:
+    """Caches the events and bot messages of completed action calls.
+
+    Entries expire after ttl seconds; if there are more than max_size
+    entries, the least recently used ones are removed.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(result)
+
+    def put(self, key: Tuple, events: List[Dict],
+            messages: List[Dict]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(),
+                                  copy.deepcopy((events, messages)))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+ACTION_RESULT_CACHE = ActionResultCache(IDEMPOTENCY_CACHE_SIZE,
+                                        IDEMPOTENCY_CACHE_TTL)
+
+# Tasks of action calls that are currently running, per key
+_in_flight = {}
+
+
+def get_request_key(action_name: Text, tracker) -> Optional[Tuple]:
+    """
+       Get the key that identifies an action call and its retries.
+        Args:
+            action_name: name of the action
+            tracker: the tracker passed to the action
+        Returns:
+            Tuple of sender ID, action name and timestamp of the latest
+            event, or None if there are no events.
+    """
+    if not tracker.events:
+        return None
+    timestamp = tracker.events[-1].get('timestamp')
+    if timestamp is None:
+        return None
+    return (tracker.current_state()['sender_id'], action_name, timestamp)
+
+
+def _replay(dispatcher, result: Tuple[List[Dict], List[Dict]]) -> List[Dict]:
+    events, messages = result
+    dispatcher.messages.extend(messages)
+    return events
+
+
+async def _run_and_cache(run, action, tracker, domain,
+                         key: Tuple) -> Tuple[List[Dict], List[Dict]]:
+    # The action collects its messages in its own dispatcher, since the
+    # request that started it may be gone by the time it finishes
+    dispatcher = CollectingDispatcher()
+    try:
+        events = await run(action, dispatcher, tracker, domain)
+        ACTION_RESULT_CACHE.put(key, events, dispatcher.messages)
+        return events, dispatcher.messages
+    finally:
+        del _in_flight[key]
+
+
+def idempotent(run):
+    """Decorator for the async run method of actions with side effects, so
+    that retries of the same call are answered from the cache and side
+    effects happen once."""
+
+    @functools.wraps(run)
+    async def wrapper(self, dispatcher, tracker, domain):
+        key = get_request_key(self.name(), tracker)
+        if key is None:
+            return await run(self, dispatcher, tracker, domain)
+
+        cached = ACTION_RESULT_CACHE.get(key)
+        if cached is not None:
+            logging.info("Answering repeated call from cache: " + str(key))
+            return _replay(dispatcher, cached)
+
+        task = _in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                _run_and_cache(run, self, tracker, domain, key))
+            _in_flight[key] = task
+            # Do not warn about an exception if no request waited for it
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            # The original call is still running, so wait for its result
+            logging.info("Waiting for running call: " + str(key))
+
+        # Shielded, so that the action still finishes and is cached if this
+        # request is cancelled (e.g., because rasa stopped waiting for it)
+        result = await asyncio.shield(task)
+        return _replay(dispatcher, copy.deepcopy(result))
+
+    return wrapper
@@ -0,0 +1,148 @@
+"""
+Circuit breaker and deadlines for calls to the MySQL database.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from definitions import (DATABASE_CIRCUIT_FAILURE_THRESHOLD,
+                         DATABASE_CIRCUIT_RESET_TIMEOUT,
+                         DATABASE_MAX_WORKERS)
+from typing import Any, Callable, List, Optional, Tuple
+
+import asyncio
+import logging
+import mysql.connector
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Stops calling the database after repeated failures.
+
+    The breaker is closed as long as calls succeed. After
+    failure_threshold consecutive failures it opens and rejects all
+    calls for reset_timeout seconds. Afterwards a single trial request is
+    let through (half-open); if it succeeds the breaker closes again,
+    otherwise it re-opens. A request may consist of several calls that
+    are made together (see run_db_calls).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow_request(self) -> bool:
+        "Check whether a call to the database may be made right now."
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Half-open: only let a single trial request through
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.info("Database circuit breaker closed again.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if (self._state == self.HALF_OPEN
+                    or self._failures >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    logging.info("Database circuit breaker opened after "
+                                 + str(self._failures) + " failure(s).")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+DB_BREAKER = CircuitBreaker(DATABASE_CIRCUIT_FAILURE_THRESHOLD,
+                            DATABASE_CIRCUIT_RESET_TIMEOUT)
+
+# Database calls run in these threads so that a slow database does not
+# block the event loop of the action server.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=DATABASE_MAX_WORKERS,
+                                  thread_name_prefix="db")
+
+
+async def run_db_calls(calls: List[Tuple[Callable[..., Any], tuple]],
+                       timeout: float) -> List[Optional[Any]]:
+    """
+       Run database calls concurrently, guarded by the circuit breaker.
+       The calls count as one request for the breaker: all of them are made
+       or none, and a single success or failure is recorded. Only database
+       errors and missed deadlines count as failures; other errors (e.g.,
+       from unexpected data) are logged but do not open the circuit.
+        Args:
+            calls: list of (function, args) tuples
+            timeout: deadline in seconds for all calls together
+        Returns:
+            List with the result of each call, or None for calls that
+            failed, did not finish in time, or were rejected because the
+            circuit breaker is open.
+    """
+    results = [None] * len(calls)
+    if not calls:
+        return results
+
+    if not DB_BREAKER.allow_request():
+        logging.info("Database circuit open, skipping "
+                     + ", ".join(func.__name__ for func, _ in calls))
+        return results
+
+    loop = asyncio.get_running_loop()
+    futures = {loop.run_in_executor(_DB_EXECUTOR, func, *args): i
+               for i, (func, args) in enumerate(calls)}
+
+    done, pending = await asyncio.wait(futures.keys(), timeout=timeout)
+
+    database_failed = False
+    for future in done:
+        error = future.exception()
+        if error is None:
+            results[futures[future]] = future.result()
+        elif isinstance(error, mysql.connector.Error):
+            database_failed = True
+            logging.info("Error in database call: " + str(error))
+        else:
+            logging.exception("Unexpected error in database call",
+                              exc_info=error)
+
+    # Calls that miss the deadline keep running in their thread, but we
+    # do not wait for them.
+    for future in pending:
+        future.add_done_callback(lambda f: f.exception())
+        database_failed = True
+        logging.info("Database call exceeded deadline of "
+                     + str(timeout) + "s.")
+
+    if database_failed:
+        DB_BREAKER.record_failure()
+    else:
+        DB_BREAKER.record_success()
+
+    return results
@@ -0,0 +1,134 @@
+"""
+Sampled, structured telemetry of the queries the action server sends to MySQL.
+
+Records are written as JSON lines to a rotating file and can be summarized
+with analyze_query_telemetry.py.
+"""
+
+from definitions import (QUERY_TELEMETRY_BACKUP_COUNT, QUERY_TELEMETRY_FILE,
+                         QUERY_TELEMETRY_HMAC_KEY, QUERY_TELEMETRY_MAX_BYTES,
+                         QUERY_TELEMETRY_SAMPLE_RATE,
+                         QUERY_TELEMETRY_SLOW_THRESHOLD)
+from logging.handlers import RotatingFileHandler
+from typing import Any, Optional, Sequence, Text
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import time
+
+
+def fingerprint_query(query: Text) -> Text:
+    """
+       Normalize a statement so that executions with different values share
+       the same fingerprint.
+        Args:
+            query: the SQL statement
+        Returns:
+            The statement with literals replaced by "?" and whitespace collapsed
+    """
+    fingerprint = re.sub(r"'(?:[^'\\]|\\.)*'", "?", query)
+    fingerprint = re.sub(r"\b\d+\b", "?", fingerprint)
+    fingerprint = re.sub(r"%s", "?", fingerprint)
+    return " ".join(fingerprint.split())
+
+
+def hash_participant(prolific_id: Optional[Text]) -> Optional[Text]:
+    """Hash the participant ID so that the telemetry does not contain it.
+    A keyed hash is used, so that the IDs cannot be recovered by hashing a
+    list of known participant IDs."""
+    if prolific_id is None:
+        return None
+    return hmac.new(QUERY_TELEMETRY_HMAC_KEY, prolific_id.encode("utf-8"),
+                    hashlib.sha256).hexdigest()[:16]
+
+
+def _create_logger() -> Optional[logging.Logger]:
+    if QUERY_TELEMETRY_SAMPLE_RATE <= 0 and QUERY_TELEMETRY_SLOW_THRESHOLD is None:
+        return None
+
+    try:
+        directory = os.path.dirname(QUERY_TELEMETRY_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(QUERY_TELEMETRY_FILE,
+                                      maxBytes=QUERY_TELEMETRY_MAX_BYTES,
+                                      backupCount=QUERY_TELEMETRY_BACKUP_COUNT)
+    except OSError as error:
+        logging.warning("Query telemetry disabled: " + str(error))
+        return None
+
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.getLogger("query_telemetry")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    # Do not also write the records to the regular log
+    logger.propagate = False
+    return logger
+
+
+_telemetry_logger = _create_logger()
+
+
+def execute_query(cur, query: Text, params: Sequence[Any],
+                  prolific_id: Optional[Text] = None) -> None:
+    """
+       Execute a statement and record it in the query telemetry if sampled.
+        Args:
+            cur: the database cursor
+            query: the SQL statement
+            params: the values for the statement
+            prolific_id: participant the statement is executed for, if any
+    """
+    start = time.perf_counter()
+    try:
+        cur.execute(query, params)
+    finally:
+        duration = time.perf_counter() - start
+        if _telemetry_logger is not None:
+            _record(cur, query, duration, prolific_id)
+
+
+def execute_many_query(cur, query: Text, params: Sequence[Sequence[Any]]) -> None:
+    """
+       Execute a statement for several rows (e.g., a multi-row insert) and
+       record it in the query telemetry if sampled.
+        Args:
+            cur: the database cursor
+            query: the SQL statement
+            params: the values for each row
+    """
+    start = time.perf_counter()
+    try:
+        cur.executemany(query, params)
+    finally:
+        duration = time.perf_counter() - start
+        if _telemetry_logger is not None:
+            _record(cur, query, duration, None)
+
+
+def _record(cur, query: Text, duration: float,
+            prolific_id: Optional[Text]) -> None:
+    slow = (QUERY_TELEMETRY_SLOW_THRESHOLD is not None
+            and duration >= QUERY_TELEMETRY_SLOW_THRESHOLD)
+    sampled = random.random() < QUERY_TELEMETRY_SAMPLE_RATE
+
+    if not (slow or sampled):
+        return
+
+    fingerprint = fingerprint_query(query)
+    record = {"time": time.time(),
+              "fingerprint": fingerprint,
+              "fingerprint_id": hashlib.md5(fingerprint.encode("utf-8")).hexdigest()[:12],
+              "duration_ms": round(duration * 1000, 3),
+              "rows": cur.rowcount,
+              "participant": hash_participant(prolific_id),
+              # Slow statements are always recorded, so they are not
+              # extrapolated by the analyzer
+              "sample_rate": 1.0 if slow else QUERY_TELEMETRY_SAMPLE_RATE,
+              "slow": slow}
+    _telemetry_logger.info(json.dumps(record))
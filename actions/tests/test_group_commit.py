@@ -0,0 +1,206 @@
+"""
+Tests for the group commit writer, using a fake database connection.
+
+Run from the actions folder: python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_commit import DatabaseUnavailableError, GroupCommitWriter
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, commit_started=None, release_commit=None):
+        self.pending_rows = []
+        self.committed_rows = []
+        self.commit_started = commit_started
+        self.release_commit = release_commit
+
+    def is_connected(self):
+        return True
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.commit_started is not None:
+            self.commit_started.set()
+            self.release_commit.wait()
+        self.committed_rows.extend(self.pending_rows)
+        self.pending_rows = []
+
+    def rollback(self):
+        self.pending_rows = []
+
+
+def fake_execute_many(cur, query, rows):
+    cur.conn.pending_rows.extend(rows)
+    cur.rowcount = len(rows)
+
+
+def make_writer(conn, flush_interval):
+    return GroupCommitWriter(flush_interval, max_rows=500,
+                             metrics_log_interval=100,
+                             connect=lambda: conn,
+                             execute_many=fake_execute_many)
+
+
+def test_rows_are_committed_before_caller_resumes():
+    conn = FakeConnection()
+    writer = make_writer(conn, 0.01)
+
+    async def save(i):
+        await asyncio.wrap_future(writer.submit("INSERT", [[i]]))
+        return list(conn.committed_rows)
+
+    async def main():
+        return await asyncio.gather(*[save(i) for i in range(20)])
+
+    for committed in asyncio.run(main()):
+        assert len(committed) == 20
+    assert writer.metrics()["rows"] == 20
+
+
+def test_submission_to_idle_writer_is_committed():
+    conn = FakeConnection()
+    writer = make_writer(conn, 0.01)
+
+    writer.submit("INSERT", [["first"]]).result(timeout=5)
+    # Let the writer go back to waiting for new submissions
+    time.sleep(0.2)
+    writer.submit("INSERT", [["second"]]).result(timeout=5)
+
+    assert conn.committed_rows == [["first"], ["second"]]
+
+
+def test_cancelled_caller_while_queued():
+    conn = FakeConnection()
+    writer = make_writer(conn, 0.2)
+
+    async def main():
+        task = asyncio.ensure_future(
+            asyncio.wrap_future(writer.submit("INSERT", [["cancelled"]])))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await asyncio.wait_for(
+            asyncio.wrap_future(writer.submit("INSERT", [["later"]])), 5)
+
+    asyncio.run(main())
+    assert writer._thread.is_alive()
+    assert conn.committed_rows == [["later"]]
+
+
+def test_cancelled_caller_while_committing():
+    commit_started = threading.Event()
+    release_commit = threading.Event()
+    conn = FakeConnection(commit_started, release_commit)
+    writer = make_writer(conn, 0.01)
+
+    async def main():
+        task = asyncio.ensure_future(
+            asyncio.wrap_future(writer.submit("INSERT", [["first"]])))
+        await asyncio.get_running_loop().run_in_executor(
+            None, commit_started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        conn.commit_started = None
+        release_commit.set()
+        await asyncio.wait_for(
+            asyncio.wrap_future(writer.submit("INSERT", [["later"]])), 5)
+
+    asyncio.run(main())
+    assert writer._thread.is_alive()
+    assert conn.committed_rows == [["first"], ["later"]]
+
+
+class FakeBreaker:
+    def __init__(self, allow):
+        self.allow = allow
+        self.outcomes = []
+
+    def allow_request(self):
+        return self.allow
+
+    def record_success(self):
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+
+
+def test_failed_connect_fails_whole_batch_at_once():
+    connects = []
+
+    def connect():
+        connects.append(1)
+        raise ConnectionError("database down")
+
+    breaker = FakeBreaker(allow=True)
+    writer = GroupCommitWriter(0.1, max_rows=500, metrics_log_interval=100,
+                               connect=connect, execute_many=fake_execute_many,
+                               breaker=breaker)
+
+    futures = [writer.submit("INSERT", [[i]]) for i in range(10)]
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+
+    assert len(connects) == 1
+    assert breaker.outcomes == [False]
+
+
+def test_statement_error_retries_submissions_separately():
+    conn = FakeConnection()
+
+    def execute_many(cur, query, rows):
+        if ["bad"] in rows:
+            raise ValueError("bad row")
+        fake_execute_many(cur, query, rows)
+
+    breaker = FakeBreaker(allow=True)
+    writer = GroupCommitWriter(0.1, max_rows=500, metrics_log_interval=100,
+                               connect=lambda: conn, execute_many=execute_many,
+                               breaker=breaker)
+
+    good = writer.submit("INSERT", [["good"]])
+    bad = writer.submit("INSERT", [["bad"]])
+    good.result(timeout=5)
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+
+    assert conn.committed_rows == [["good"]]
+    assert breaker.outcomes == [True]
+
+
+def test_open_circuit_rejects_without_connecting():
+    def connect():
+        raise AssertionError("should not connect")
+
+    writer = GroupCommitWriter(0.01, max_rows=500, metrics_log_interval=100,
+                               connect=connect, execute_many=fake_execute_many,
+                               breaker=FakeBreaker(allow=False))
+
+    with pytest.raises(DatabaseUnavailableError):
+        writer.submit("INSERT", [["row"]]).result(timeout=5)
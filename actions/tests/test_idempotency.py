@@ -0,0 +1,98 @@
+"""
+Tests for the de-duplication of repeated action calls.
+
+Run from the actions folder: python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+ACTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ACTIONS_DIR)
+
+# definitions.py reads Activities.xlsx from the working directory
+pytest.importorskip("pandas")
+pytest.importorskip("rasa_sdk")
+
+
+class FakeTracker:
+    def __init__(self, timestamp):
+        self.events = [{"event": "action", "timestamp": timestamp}]
+
+    def current_state(self):
+        return {"sender_id": "participant"}
+
+
+@pytest.fixture
+def idempotency(monkeypatch):
+    monkeypatch.chdir(ACTIONS_DIR)
+    import idempotency
+    return idempotency
+
+
+def make_action(idempotency, calls, release):
+
+    class SlowAction:
+        def name(self):
+            return "action_slow"
+
+        @idempotency.idempotent
+        async def run(self, dispatcher, tracker, domain):
+            calls.append(tracker.events[-1]["timestamp"])
+            await release.wait()
+            dispatcher.utter_message(text="done")
+            return [{"event": "slot", "name": "saved", "value": True}]
+
+    return SlowAction()
+
+
+def test_retry_answered_from_cache(idempotency):
+    from rasa_sdk.executor import CollectingDispatcher
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+        release.set()
+        action = make_action(idempotency, calls, release)
+        first = CollectingDispatcher()
+        retry = CollectingDispatcher()
+        events = await action.run(first, FakeTracker(1.0), {})
+        assert await action.run(retry, FakeTracker(1.0), {}) == events
+        assert retry.messages == first.messages
+
+    asyncio.run(main())
+    assert calls == [1.0]
+
+
+def test_retry_waits_when_original_is_cancelled(idempotency):
+    from rasa_sdk.executor import CollectingDispatcher
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+        action = make_action(idempotency, calls, release)
+        original = asyncio.ensure_future(
+            action.run(CollectingDispatcher(), FakeTracker(2.0), {}))
+        await asyncio.sleep(0)
+        retry_dispatcher = CollectingDispatcher()
+        retry = asyncio.ensure_future(
+            action.run(retry_dispatcher, FakeTracker(2.0), {}))
+        await asyncio.sleep(0)
+
+        original.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await original
+
+        release.set()
+        events = await asyncio.wait_for(retry, 5)
+        assert events == [{"event": "slot", "name": "saved", "value": True}]
+        assert len(retry_dispatcher.messages) == 1
+
+        # A later retry is answered from the cache
+        await action.run(CollectingDispatcher(), FakeTracker(2.0), {})
+
+    asyncio.run(main())
+    assert calls == [2.0]
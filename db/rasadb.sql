@@ -5,6 +5,9 @@ CREATE TABLE users(idx INT NOT NULL AUTO_INCREMENT, prolific_id TEXT, name TEXT,
 CREATE TABLE sessiondata(idx INT NOT NULL AUTO_INCREMENT, prolific_id TEXT, session_num TEXT, response_type TEXT,
 response_value TEXT, time DATETIME, CONSTRAINT sessiondata_pk PRIMARY KEY (idx));
 
-SET global general_log = 1;
+-- The general query log costs write throughput and grows without bound.
+-- The action server records sampled query telemetry instead (see
+-- actions/telemetry.py). Set this to 1 to log every statement for debugging.
+SET global general_log = 0;
 SET global general_log_file='/var/log/mysql/mysql.log';
 SET global log_output = 'file'; 
@@ -1,3 +1,9 @@
+// Whether to talk to Rasa over a persistent socket.io connection (see the
+// "socketio" entry in backend/credentials.yml). Bot messages are then shown as
+// soon as Rasa produces them. If the connection cannot be established, we fall
+// back to the REST channel.
+var use_socket_channel = true;
+
 // ========================== start session ========================
 $(document).ready(function () {
 
@@ -6,6 +12,9 @@ $(document).ready(function () {
     const urlParams = new URLSearchParams(queryString);
     const userid = urlParams.get('userid');
 	user_id = userid;
+	if (use_socket_channel) {
+		connectSocket();
+	}
 	//get session number
 	const session_num = urlParams.get('n');
 	
@@ -92,6 +101,14 @@ function scrollToBottomOfResults() {
 
 //============== send the user message to rasa server =============================================
 function send(message) {
+	if (use_socket_channel) {
+		sendSocket(message);
+	} else {
+		sendRest(message);
+	}
+}
+
+function sendRest(message) {
 	var url = document.location.protocol + "//" + document.location.hostname;
 	$.ajax({
 
@@ -114,6 +131,166 @@ function send(message) {
 	});
 }
 
+//============== persistent socket.io connection to rasa server ===================================
+var socket = null;
+// Messages that are sent before rasa has confirmed the session
+var pending_user_messages = [];
+var socket_session_confirmed = false;
+// Whether the session has been confirmed at least once; afterwards we do not
+// switch to the REST channel anymore, since that would be a new conversation
+var socket_session_ever_confirmed = false;
+var socket_fallback_shown = false;
+// Bot messages that have been received but not yet displayed
+var bot_message_queue = [];
+var showing_bot_message = false;
+// Show the fallback message if rasa does not answer within this many milliseconds
+var socket_response_timeout_ms = 60000;
+var socket_response_timer = null;
+
+function connectSocket() {
+	if (typeof io === "undefined") {
+		console.log("socket.io client not loaded, using REST channel.");
+		use_socket_channel = false;
+		return;
+	}
+
+	var url = document.location.protocol + "//" + document.location.hostname;
+	socket = io(url, { path: "/socket.io", transports: ["websocket"] });
+
+	// The user ID is used as session ID, so that it becomes the sender ID in rasa.
+	// This also happens again after a reconnect.
+	socket.on("connect", function () {
+		socket.emit("session_request", { session_id: user_id });
+	});
+
+	socket.on("session_confirm", function () {
+		socket_session_confirmed = true;
+		socket_session_ever_confirmed = true;
+		socket_fallback_shown = false;
+		while (pending_user_messages.length > 0) {
+			socket.emit("user_uttered", { message: pending_user_messages.shift(), session_id: user_id });
+		}
+	});
+
+	socket.on("disconnect", function () {
+		socket_session_confirmed = false;
+	});
+
+	// If we cannot connect at all, use the REST channel instead.
+	// If we cannot reconnect, tell the user; socket.io keeps trying to reconnect.
+	socket.on("connect_error", function (error) {
+		console.log("Error connecting to socket: ", error);
+		if (socket_session_ever_confirmed) {
+			if (!socket_fallback_shown) {
+				showSocketFallbackMessage();
+			}
+		} else {
+			clearTimeout(socket_response_timer);
+			socket.close();
+			use_socket_channel = false;
+			while (pending_user_messages.length > 0) {
+				sendRest(pending_user_messages.shift());
+			}
+		}
+	});
+
+	socket.on("bot_uttered", function (botMessage) {
+		console.log("Response from Rasa: ", botMessage);
+		clearTimeout(socket_response_timer);
+		// The socket.io channel sends buttons as "quick_replies"
+		if (botMessage.hasOwnProperty("quick_replies")) {
+			botMessage.buttons = botMessage.quick_replies;
+		}
+		bot_message_queue.push(botMessage);
+		if (!showing_bot_message) {
+			hideBotTyping();
+			showBotTyping();
+			$('.usrInput').attr("disabled",true);
+			$(".usrInput").prop('placeholder', "Wait for Mel's response.");
+			showNextBotMessage();
+		}
+	});
+}
+
+function sendSocket(message) {
+	if (socket_session_confirmed) {
+		socket.emit("user_uttered", { message: message, session_id: user_id });
+	} else {
+		pending_user_messages.push(message);
+	}
+
+	// if there is no response from rasa server
+	clearTimeout(socket_response_timer);
+	socket_response_timer = setTimeout(function () {
+		console.log("No response from Rasa over socket.");
+		showSocketFallbackMessage();
+	}, socket_response_timeout_ms);
+}
+
+// Same message as for errors of the REST channel, but the user can type again
+function showSocketFallbackMessage() {
+	clearTimeout(socket_response_timer);
+	socket_fallback_shown = true;
+	hideBotTyping();
+
+	var fallbackMsg = "I am facing some issues, please try again later!!!";
+	var BotResponse = '<img class="botAvatar" src="/img/chatbot_picture.png"/><p class="botMsg">' + fallbackMsg + '</p><div class="clearfix"></div>';
+	$(BotResponse).appendTo(".chats").hide().fadeIn(1000);
+
+	$('.usrInput').attr("disabled",false);
+	$(".usrInput").prop('placeholder', "Type a message...");
+	scrollToBottomOfResults();
+}
+
+// Show the queued bot messages one after the other, with a delay based on
+// the length of each message.
+function showNextBotMessage() {
+	if (bot_message_queue.length == 0) {
+		showing_bot_message = false;
+		return;
+	}
+	showing_bot_message = true;
+
+	var message = bot_message_queue[0];
+	var delay = 500;
+	if (message.hasOwnProperty("text")) {
+		delay = Math.min(Math.max(message.text.length * 45, 800), 5000);
+	}
+
+	setTimeout(function () {
+		bot_message_queue.shift();
+		hideBotTyping();
+
+		//check if the response contains "text"
+		if (message.hasOwnProperty("text")) {
+			var response_text = message.text.split("\n")
+			for (j = 0; j < response_text.length; j++){
+				var BotResponse = '<img class="botAvatar" src="/img/chatbot_picture.png"/><p class="botMsg">' + response_text[j] + '</p><div class="clearfix"></div>';
+				$(BotResponse).appendTo(".chats").hide().fadeIn(1000);
+			}
+		}
+
+		//check if the response contains "buttons"
+		if (message.hasOwnProperty("buttons")) {
+			addSuggestion(message.buttons);
+		}
+		//enable the text field again if no other bot message is waiting to be shown
+		else if (bot_message_queue.length == 0) {
+			$('.usrInput').attr("disabled",false);
+			$(".usrInput").prop('placeholder', "Type a message...");
+		}
+
+		scrollToBottomOfResults();
+
+		if (bot_message_queue.length > 0) {
+			showBotTyping();
+			$('.usrInput').attr("disabled",true);
+			$(".usrInput").prop('placeholder', "Wait for Mel's response.");
+		}
+		showNextBotMessage();
+	}, delay);
+}
+
 //=================== set bot response in the chats ===========================================
 function setBotResponse(response) {
 